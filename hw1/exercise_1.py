@@ -1,3 +1,17 @@
+import math
+import mmap
+import multiprocessing
+import os
+import random
+import re
+import sys
+from itertools import permutations
+from array import array
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+
 def prepare_key(k) -> list[list[str]]:
     """
     Checks the validity of a key. And normalize.
@@ -33,34 +47,39 @@ def _pairs(s: str) -> list[(str, str)]:
     return [(s[i], s[i + 1]) for i in range(0, len(s), 2)]
 
 
-def prepare_message(m: str) -> list[(str, str)]:
-    """
-    Prepares a plain text message to be encrypted.
-    """
+def _normalize_message(m: str) -> str:
     # normalize:
     # - turn all j's into i's
     # - lowercase
     # - remove special characters (FIXME)
-    m = "".join(c for c in m.replace("j", "i").lower() if c.isalpha())
+    return "".join(c for c in m.replace("j", "i").lower() if c.isalpha())
+
 
-    res = ""
+def prepare_message(m: str) -> list[(str, str)]:
+    """
+    Prepares a plain text message to be encrypted.
+    """
+    m = _normalize_message(m)
+
+    # collect characters in a list, repeated string concatenation is quadratic
+    res = []
     for i in range(len(m)):
-        res += m[i]
+        res.append(m[i])
         # if two consequitive characters are equal, separate them with an 'x'
         if i != len(m) - 1 and m[i] == m[i + 1]:
             # this will produce two consequitive 'x', this breaks encryption rules
             if m[i] == "x":
                 raise RuntimeError("Unsupported message")
-            res += "x"
+            res.append("x")
 
     # if a string has odd length, pad it with an extra 'x'
     if len(res) % 2 == 1:
         if res[-1] == "x":
             # this will produce two consequitive 'x', this breaks encryption rules
             raise RuntimeError("Unsupported message")
-        res += "x"
+        res.append("x")
 
-    return _pairs(res)
+    return _pairs("".join(res))
 
 
 def _index_dict(k) -> dict[str, (int, int)]:
@@ -70,52 +89,862 @@ def _index_dict(k) -> dict[str, (int, int)]:
     return dict((c, (i, j)) for i in range(len(k)) for (j, c) in enumerate(k[i]))
 
 
-def encrypt(k: list[list[str]], m: str) -> str:
-    k = prepare_key(k)
+_ALPHABET = "abcdefghiklmnopqrstuvwxyz"
+_LETTER_INDEX = dict((c, i) for (i, c) in enumerate(_ALPHABET))
 
-    pairs = prepare_message(m)
 
+def _digram_table(k, shift: int) -> tuple[str, ...]:
+    """
+    Precomputes the mapping of every digram under a key. Shift of 1 encrypts, shift of -1 decrypts.
+    The table is indexed with `_LETTER_INDEX[m1] * 25 + _LETTER_INDEX[m2]`.
+    """
     k_index = _index_dict(k)
 
-    encrypted = ""
-    for m1, m2 in pairs:
-        (r1, c1) = k_index[m1]
-        (r2, c2) = k_index[m2]
+    table = []
+    for m1 in _ALPHABET:
+        for m2 in _ALPHABET:
+            r1, c1 = k_index[m1]
+            r2, c2 = k_index[m2]
 
-        if r1 == r2:
-            # shift to the right with wrapping
-            encrypted += k[r1][(c1 + 1) % 5] + k[r2][(c2 + 1) % 5]
-        elif c1 == c2:
-            # shift down with wrapping
-            encrypted += k[(r1 + 1) % 5][c1] + k[(r2 + 1) % 5][c2]
+            if r1 == r2:
+                # shift horizontally with wrapping
+                table.append(k[r1][(c1 + shift) % 5] + k[r2][(c2 + shift) % 5])
+            elif c1 == c2:
+                # shift vertically with wrapping
+                table.append(k[(r1 + shift) % 5][c1] + k[(r2 + shift) % 5][c2])
+            else:
+                # swap coordinates
+                table.append(k[r1][c2] + k[r2][c1])
+    return tuple(table)
+
+
+class PlayfairKey:
+    """
+    A validated and normalized key compiled into digram lookup tables. Instances are immutable,
+    hashable and compare equal when their matrices are equal.
+    """
+
+    __slots__ = ("matrix", "encrypt_table", "decrypt_table")
+
+    def __init__(self, matrix: tuple[str, ...]):
+        # matrix is a normalized key (as returned by `prepare_key`) with rows joined into strings
+        object.__setattr__(self, "matrix", matrix)
+        object.__setattr__(self, "encrypt_table", _digram_table(matrix, 1))
+        object.__setattr__(self, "decrypt_table", _digram_table(matrix, -1))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PlayfairKey is immutable")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PlayfairKey) and self.matrix == other.matrix
+
+    def __hash__(self) -> int:
+        return hash(self.matrix)
+
+    def __repr__(self) -> str:
+        return f"PlayfairKey({self.matrix!r})"
+
+    def __reduce__(self):
+        # tables are cheap to rebuild, so only the matrix is pickled
+        return (_compile_normalized, (self.matrix,))
+
+
+@lru_cache(maxsize=256)
+def _compile_normalized(matrix: tuple[str, ...]) -> PlayfairKey:
+    return PlayfairKey(matrix)
+
+
+def compile_key(k) -> PlayfairKey:
+    """
+    Validates a key and compiles it. Compiled keys are cached by their normalized matrix,
+    so compiling the same key again is cheap.
+    """
+    if isinstance(k, PlayfairKey):
+        return k
+    return _compile_normalized(tuple("".join(r) for r in prepare_key(k)))
+
+
+def _map_pairs(table: tuple[str, ...], pairs: list[(str, str)]) -> str:
+    """
+    Maps each pair through a digram table and joins the results.
+    """
+    return "".join(
+        table[_LETTER_INDEX[m1] * 25 + _LETTER_INDEX[m2]] for m1, m2 in pairs
+    )
+
+
+def encrypt(k, m: str) -> str:
+    """
+    Encrypts a message with either a raw key matrix or a compiled `PlayfairKey`.
+    """
+    return _map_pairs(compile_key(k).encrypt_table, prepare_message(m))
+
+
+def decrypt(k, encrypted: str) -> str:
+    """
+    Decrypts a message with either a raw key matrix or a compiled `PlayfairKey`.
+    """
+    return _map_pairs(compile_key(k).decrypt_table, _pairs(encrypted))
+
+
+class PlayfairEncryptor:
+    """
+    Incrementally encrypts a message fed in chunks. Concatenating the outputs of `update` and
+    `finalize` gives exactly `encrypt(k, m)` where `m` is the concatenation of all chunks.
+    After `finalize` the encryptor can be reused for a new message.
+    """
+
+    def __init__(self, k):
+        self._table = compile_key(k).encrypt_table
+        self._reset()
+
+    def _reset(self):
+        # last normalized character of the message, used to detect doubled letters
+        self._last = None
+        # first half of a digram waiting for its second character
+        self._half = None
+
+    def _push(self, c: str, out: list[str]):
+        if self._half is None:
+            self._half = c
         else:
-            # swap coordinates
-            encrypted += k[r1][c2] + k[r2][c1]
+            out.append(self._table[_LETTER_INDEX[self._half] * 25 + _LETTER_INDEX[c]])
+            self._half = None
 
-    return encrypted
+    def update(self, chunk: str) -> str:
+        """
+        Consumes a chunk of the message and returns the digrams that are complete so far.
+        """
+        out = []
+        # same normalization as `prepare_message`, it only depends on single characters
+        for c in chunk.replace("j", "i").lower():
+            if not c.isalpha():
+                continue
+            # if two consequitive characters are equal, separate them with an 'x'
+            if c == self._last:
+                # this will produce two consequitive 'x', this breaks encryption rules
+                if c == "x":
+                    raise RuntimeError("Unsupported message")
+                self._push("x", out)
+            self._push(c, out)
+            self._last = c
+        return "".join(out)
 
+    def finalize(self) -> str:
+        """
+        Pads the pending character, if any, and returns the last digram.
+        """
+        out = []
+        if self._half is not None:
+            if self._half == "x":
+                # this will produce two consequitive 'x', this breaks encryption rules
+                raise RuntimeError("Unsupported message")
+            self._push("x", out)
+        self._reset()
+        return "".join(out)
 
-def decrypt(k: list[list[str]], encrypted: str) -> str:
-    k = prepare_key(k)
 
-    k_index = _index_dict(k)
+class PlayfairDecryptor:
+    """
+    Incrementally decrypts a ciphertext fed in chunks. Concatenating the outputs of `update` and
+    `finalize` gives exactly `decrypt(k, encrypted)`. After `finalize` the decryptor can be reused.
+    """
+
+    def __init__(self, k):
+        self._table = compile_key(k).decrypt_table
+        self._half = None
+
+    def update(self, chunk: str) -> str:
+        """
+        Consumes a chunk of the ciphertext and returns the decrypted complete digrams.
+        """
+        if self._half is not None:
+            chunk = self._half + chunk
+            self._half = None
+        if len(chunk) % 2 == 1:
+            # keep the unpaired character for the next chunk
+            self._half = chunk[-1]
+            chunk = chunk[:-1]
+        return _map_pairs(self._table, _pairs(chunk))
+
+    def finalize(self) -> str:
+        """
+        Checks that the whole ciphertext consisted of full digrams.
+        """
+        if self._half is not None:
+            self._half = None
+            raise RuntimeError("Encrypted message does not have an even length")
+        return ""
+
+
+# a character followed by the same character
+_DOUBLED = re.compile(r"(.)(?=\1)", re.DOTALL)
+
+
+def _shard_info(m: str) -> tuple[int, int, str, str]:
+    """
+    Returns the normalized length, the number of doubled letters, the first and the last normalized
+    character of a shard of a message.
+    """
+    m = _normalize_message(m)
+    # this will produce two consequitive 'x', this breaks encryption rules
+    if "xx" in m:
+        raise RuntimeError("Unsupported message")
+    return (len(m), len(_DOUBLED.findall(m)), m[:1], m[-1:])
+
+
+def _encrypt_shard(k: PlayfairKey, m: str, prev: str, carry: bool, last: bool) -> str:
+    """
+    Encrypts a shard of a message. `prev` is the last normalized character before the shard and
+    `carry` tells if it is unpaired, i.e. it forms a digram with the first character of this shard.
+    """
+    m = _normalize_message(m)
+
+    # same as `prepare_message`, separate doubled characters with an 'x'
+    res = _DOUBLED.sub(r"\1x", m)
+    if m and m[0] == prev:
+        res = "x" + res
+    if carry:
+        res = prev + res
+
+    if len(res) % 2 == 1:
+        if last:
+            # if a string has odd length, pad it with an extra 'x'
+            if res[-1] == "x":
+                raise RuntimeError("Unsupported message")
+            res += "x"
+        else:
+            # unpaired character is encrypted by the next shard
+            res = res[:-1]
+
+    return _map_pairs(k.encrypt_table, _pairs(res))
+
+
+def encrypt_parallel(k, m: str, workers: int | None = None) -> str:
+    """
+    Same as `encrypt` but splits the message into shards which are encrypted in a process pool.
+
+    Inserting 'x' between doubled letters shifts the digram alignment, so a first parallel pass
+    counts doubled letters in each shard. A cheap sequential pass over these counts finds whether a
+    shard starts in the middle of a digram. A second parallel pass then encrypts the shards independently.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return encrypt(k, m)
+
+    k = compile_key(k)
+
+    # a few shards per worker to balance the load
+    size = max(1, -(-len(m) // (4 * workers)))
+    shards = [m[i : i + size] for i in range(0, len(m), size)] or [""]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        infos = list(pool.map(_shard_info, shards))
+
+        # prefix pass: length of the prepared message before each shard
+        args = []
+        prev, length = "", 0
+        for i, (n, doubled, first, last) in enumerate(infos):
+            args.append((k, shards[i], prev, length % 2 == 1, i == len(shards) - 1))
+            if n == 0:
+                continue
+            if first == prev:
+                # this will produce two consequitive 'x', this breaks encryption rules
+                if first == "x":
+                    raise RuntimeError("Unsupported message")
+                length += 1
+            length += n + doubled
+            prev = last
+
+        return "".join(pool.map(_encrypt_shard, *zip(*args)))
+
+
+# bytes are processed in blocks of this size, so memory use does not grow with the input
+_BYTES_BLOCK = 1 << 20
+# normalize bytes: lowercase letters, turn all j's (and J's) into i's
+_BYTES_NORMALIZE = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZj", b"abcdefghiiklmnopqrstuvwxyzi"
+)
+# remove everything that is not an ascii letter
+_BYTES_DELETE = bytes(
+    c for c in range(256) if not chr(c).isascii() or not chr(c).isalpha()
+)
+# a character followed by the same character
+_BYTES_DOUBLED = re.compile(rb"(.)(?=\1)", re.DOTALL)
+
+
+@lru_cache(maxsize=256)
+def _bytes_table(k: PlayfairKey, decrypt: bool) -> dict[int, int]:
+    """
+    Converts a digram table to a mapping between digrams read as native 16 bit integers.
+    """
+    table = k.decrypt_table if decrypt else k.encrypt_table
+    return dict(
+        (
+            int.from_bytes((m1 + m2).encode(), sys.byteorder),
+            int.from_bytes(
+                table[_LETTER_INDEX[m1] * 25 + _LETTER_INDEX[m2]].encode(),
+                sys.byteorder,
+            ),
+        )
+        for m1 in _ALPHABET
+        for m2 in _ALPHABET
+    )
+
+
+def _prepared_blocks(data) -> Iterator[bytes]:
+    """
+    Same as `prepare_message` but for bytes, yields the prepared message in blocks of even length.
+    """
+    with memoryview(data) as view:
+        last = b""  # last normalized character of the previous block
+        half = b""  # unpaired character of the previous block
+        for start in range(0, len(view), _BYTES_BLOCK):
+            block = view[start : start + _BYTES_BLOCK].tobytes()
+            block = block.translate(_BYTES_NORMALIZE, _BYTES_DELETE)
+            if not block:
+                continue
+
+            # two consequitive 'x' break encryption rules
+            if b"xx" in block or block[:1] == last == b"x":
+                raise RuntimeError("Unsupported message")
+            # doubled character on the block boundary
+            prefix = b"x" if block[:1] == last else b""
+            last = block[-1:]
+
+            block = half + prefix + _BYTES_DOUBLED.sub(rb"\1x", block)
+            half = block[-1:] if len(block) % 2 == 1 else b""
+            yield block[: len(block) - len(half)]
+
+    # if a message has odd length, pad it with an extra 'x'
+    if half:
+        if half == b"x":
+            raise RuntimeError("Unsupported message")
+        yield half + b"x"
+
+
+def _map_bytes(table: dict[int, int], data, out, n: int) -> int:
+    """
+    Maps the even length `data` digram by digram to `out` at offset `n`. Returns the new offset.
+    """
+    if n + len(data) > len(out):
+        raise RuntimeError("Output buffer is too small")
+    with memoryview(data) as src, out[n : n + len(data)] as dst:
+        with src.cast("H") as src16, dst.cast("H") as dst16:
+            dst16[:] = array("H", map(table.__getitem__, src16))
+    return n + len(data)
+
+
+def encrypted_size(m) -> int:
+    """
+    Returns the length of the ciphertext of a bytes-like message.
+    """
+    return sum(len(block) for block in _prepared_blocks(m))
+
+
+def encrypt_into(k, m, out) -> int:
+    """
+    Encrypts a bytes-like message (bytes, memoryview, mmap, ...) into the writable buffer `out`.
+    Only ascii letters are encrypted. Returns the number of bytes written.
+    """
+    table = _bytes_table(compile_key(k), False)
+    with memoryview(out) as view, view.cast("B") as dst:
+        n = 0
+        for block in _prepared_blocks(m):
+            n = _map_bytes(table, block, dst, n)
+    return n
+
+
+def decrypt_into(k, encrypted, out) -> int:
+    """
+    Decrypts a bytes-like ciphertext into the writable buffer `out`. Returns the number of bytes written.
+    """
+    table = _bytes_table(compile_key(k), True)
+    with memoryview(encrypted) as view, view.cast("B") as src:
+        if len(src) % 2 == 1:
+            raise RuntimeError("Encrypted message does not have an even length")
+        with memoryview(out) as view, view.cast("B") as dst:
+            n = 0
+            for start in range(0, len(src), _BYTES_BLOCK):
+                with src[start : start + _BYTES_BLOCK] as block:
+                    n = _map_bytes(table, block, dst, n)
+    return n
+
+
+def encrypt_bytes(k, m) -> bytearray:
+    """
+    Encrypts a bytes-like message into a new preallocated bytearray.
+    """
+    out = bytearray(encrypted_size(m))
+    encrypt_into(k, m, out)
+    return out
+
+
+def decrypt_bytes(k, encrypted) -> bytearray:
+    """
+    Decrypts a bytes-like ciphertext into a new preallocated bytearray.
+    """
+    out = bytearray(len(encrypted))
+    decrypt_into(k, encrypted, out)
+    return out
+
+
+def _map_file(src: str, dst: str, size: Callable[[mmap.mmap], int], f: Callable) -> int:
+    """
+    Memory maps `src`, creates `dst` of the given size, memory maps it and runs `f` on both maps.
+    """
+    with open(src, "rb") as fin, open(dst, "w+b") as fout:
+        # empty files cannot be memory mapped
+        if os.fstat(fin.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            n = size(data)
+            if n == 0:
+                return 0
+            fout.truncate(n)
+            with mmap.mmap(fout.fileno(), n, access=mmap.ACCESS_WRITE) as out:
+                f(data, out)
+                out.flush()
+    return n
+
+
+def encrypt_file(k, src: str, dst: str) -> int:
+    """
+    Encrypts the file `src` into the file `dst` through memory maps. Returns the ciphertext length.
+    """
+    k = compile_key(k)
+    return _map_file(src, dst, encrypted_size, lambda m, out: encrypt_into(k, m, out))
 
-    m = ""
-    for m1, m2 in _pairs(encrypted):
-        (r1, c1) = k_index[m1]
-        (r2, c2) = k_index[m2]
 
+def decrypt_file(k, src: str, dst: str) -> int:
+    """
+    Decrypts the file `src` into the file `dst` through memory maps. Returns the plaintext length.
+    """
+    k = compile_key(k)
+    return _map_file(src, dst, len, lambda m, out: decrypt_into(k, m, out))
+
+
+def letter_ids(m: str) -> list[int]:
+    """
+    Normalizes a text and returns its letters as indices into `_ALPHABET`.
+    """
+    return [_LETTER_INDEX[c] for c in _normalize_message(m) if c in _LETTER_INDEX]
+
+
+class NgramModel:
+    """
+    Log (base 10) probabilities of letter n-grams. An n-gram is indexed by its letters read as a
+    base 25 number, where letters are numbered by their position in `_ALPHABET`.
+    """
+
+    def __init__(self, n: int, log_probs: list[float], expected: float):
+        self.n = n
+        self.log_probs = log_probs
+        # average log probability of an n-gram in the training text
+        self.expected = expected
+
+    @staticmethod
+    def from_text(text: str, n: int = 4) -> "NgramModel":
+        """
+        Counts n-grams of a training text. Unseen n-grams get a small floor probability.
+        """
+        size = 25**n
+        counts = [0] * size
+        index = 0
+        for i, c in enumerate(letter_ids(text)):
+            index = (index * 25 + c) % size
+            if i >= n - 1:
+                counts[index] += 1
+
+        total = max(1, sum(counts))
+        floor = math.log10(0.01 / total)
+        log_probs = [math.log10(c / total) if c else floor for c in counts]
+        expected = sum(c * p for c, p in zip(counts, log_probs) if c) / total
+        return NgramModel(n, log_probs, expected)
+
+    def score(self, ids: list[int], start: int = 0, stop: int | None = None) -> float:
+        """
+        Sums log probabilities of the n-grams starting at positions `start` to `stop` (exclusive)
+        of a text given as letter indices. By default all n-grams are summed.
+        """
+        n = self.n
+        if stop is None:
+            stop = len(ids) - n + 1
+        if stop <= start:
+            return 0.0
+
+        log_probs = self.log_probs
+        size = 25 ** (n - 1)
+        index = 0
+        for c in ids[start : start + n - 1]:
+            index = index * 25 + c
+        # rolling index, drop the oldest letter and add a new one
+        total = 0.0
+        for c in ids[start + n - 1 : stop + n - 1]:
+            index = index % size * 25 + c
+            total += log_probs[index]
+        return total
+
+
+@lru_cache(maxsize=1)
+def english_model() -> NgramModel:
+    """
+    Quadgram model of English trained on the interactive help bundled with Python,
+    which is a few hundred kilobytes of English prose.
+    """
+    from pydoc_data.topics import topics
+
+    return NgramModel.from_text(" ".join(topics.values()), 4)
+
+
+def _decrypt_types(cells: list[int], types: list[int]) -> list[tuple[int, int]]:
+    """
+    Decrypts digram types (`m1 * 25 + m2`) with a key given as a flat list of 25 letter indices.
+    """
+    where = [0] * 25
+    for i, c in enumerate(cells):
+        where[c] = i
+
+    res = []
+    for t in types:
+        r1, c1 = divmod(where[t // 25], 5)
+        r2, c2 = divmod(where[t % 25], 5)
         if r1 == r2:
             # shift to the left with wrapping
-            m += k[r1][(c1 - 1) % 5] + k[r2][(c2 - 1) % 5]
+            res.append((cells[r1 * 5 + (c1 - 1) % 5], cells[r2 * 5 + (c2 - 1) % 5]))
         elif c1 == c2:
             # shift up with wrapping
-            m += k[(r1 - 1) % 5][c1] + k[(r2 - 1) % 5][c2]
+            res.append((cells[(r1 - 1) % 5 * 5 + c1], cells[(r2 - 1) % 5 * 5 + c2]))
         else:
             # swap coordinates
-            m += k[r1][c2] + k[r2][c1]
+            res.append((cells[r1 * 5 + c2], cells[r2 * 5 + c1]))
+    return res
+
+
+def _mutate(cells: list[int], rng: random.Random) -> list[int]:
+    """
+    Returns a slightly modified key. Mostly swaps two letters, sometimes rows, columns or transposes.
+    """
+    cells = cells[:]
+    x = rng.random()
+    if x < 0.9:
+        i, j = rng.sample(range(25), 2)
+        cells[i], cells[j] = cells[j], cells[i]
+    elif x < 0.94:
+        i, j = rng.sample(range(5), 2)
+        cells[i * 5 : i * 5 + 5], cells[j * 5 : j * 5 + 5] = (
+            cells[j * 5 : j * 5 + 5],
+            cells[i * 5 : i * 5 + 5],
+        )
+    elif x < 0.98:
+        i, j = rng.sample(range(5), 2)
+        for r in range(5):
+            cells[r * 5 + i], cells[r * 5 + j] = cells[r * 5 + j], cells[r * 5 + i]
+    else:
+        cells = [cells[(i % 5) * 5 + i // 5] for i in range(25)]
+    return cells
+
+
+# set in each cracking process by `_init_crack`
+_crack_model: NgramModel = None
+_crack_best = None
+
+
+def _init_crack(model: NgramModel, best):
+    global _crack_model, _crack_best
+    _crack_model = model
+    _crack_best = best
+
+
+def _anneal(
+    encrypted: list[int], iterations: int, temperature: float, threshold: float, seed
+) -> tuple[float, list[int]]:
+    """
+    Runs one simulated annealing search from a random key. Returns the best score per n-gram and key.
+    """
+    model, best_shared = _crack_model, _crack_best
+    n = model.n
+    windows = len(encrypted) - n + 1
+    rng = random.Random(seed)
+
+    # a key change only changes the decryption of some digram types, so we keep track
+    # of where each digram type occurs and update only those positions
+    occurrences = {}
+    for j in range(0, len(encrypted), 2):
+        occurrences.setdefault(encrypted[j] * 25 + encrypted[j + 1], []).append(j)
+    types = list(occurrences)
+    positions = [occurrences[t] for t in types]
+
+    cells = list(range(25))
+    rng.shuffle(cells)
+    plain = _decrypt_types(cells, types)
+    pt = [0] * len(encrypted)
+    for (x, y), js in zip(plain, positions):
+        for j in js:
+            pt[j], pt[j + 1] = x, y
+    score = model.score(pt)
+    best = (score, cells)
+
+    for it in range(iterations):
+        if it % 256 == 0:
+            # stop when any process found a good enough key
+            if best_shared.value >= threshold:
+                break
+
+        new_cells = _mutate(cells, rng)
+        new_plain = _decrypt_types(new_cells, types)
+        changed = [i for i in range(len(types)) if new_plain[i] != plain[i]]
+
+        # rescore only the n-grams overlapping changed digrams, merged into ranges,
+        # unless that is most of the text anyway
+        ranges = []
+        for j in sorted(j for i in changed for j in positions[i]):
+            start, stop = max(0, j - n + 1), min(windows, j + 2)
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = stop
+            else:
+                ranges.append([start, stop])
+        partial = sum(stop - start for start, stop in ranges) * 2 < windows
+        if partial:
+            old = sum(model.score(pt, start, stop) for start, stop in ranges)
+        for i in changed:
+            x, y = new_plain[i]
+            for j in positions[i]:
+                pt[j], pt[j + 1] = x, y
+        if partial:
+            new = sum(model.score(pt, start, stop) for start, stop in ranges)
+            new_score = score + new - old
+        else:
+            new_score = model.score(pt)
+
+        # linear cooling
+        t = temperature * (1 - it / iterations) + 0.01
+        delta = new_score - score
+        if delta >= 0 or rng.random() < math.exp(delta / t):
+            cells, plain, score = new_cells, new_plain, new_score
+            if score > best[0]:
+                best = (score, cells)
+                per_window = score / windows
+                with best_shared.get_lock():
+                    if per_window > best_shared.value:
+                        best_shared.value = per_window
+                if per_window >= threshold:
+                    break
+        else:
+            # revert
+            for i in changed:
+                x, y = plain[i]
+                for j in positions[i]:
+                    pt[j], pt[j + 1] = x, y
+
+    return (best[0] / windows, best[1])
+
+
+def crack(
+    encrypted: str,
+    model: NgramModel | None = None,
+    restarts: int = 16,
+    iterations: int = 20000,
+    temperature: float = 20.0,
+    threshold: float | None = None,
+    workers: int | None = None,
+    seed=None,
+) -> tuple[PlayfairKey, float]:
+    """
+    Recovers a key from a ciphertext only. Runs independent simulated annealing searches in a process
+    pool and returns the key whose decryption scores best under the n-gram model, together with its
+    average n-gram log probability.
+
+    The default temperature suits ciphertexts of about a thousand characters. The search stops early
+    once a decryption scores at least `threshold` per n-gram, which defaults to well below the
+    score of the model's own training text. Keys are only recovered up to cyclic shifts of rows and
+    columns, which encrypt identically anyway.
+    """
+    model = model or english_model()
+    if threshold is None:
+        # inserted 'x's make prepared messages score noticeably worse than natural text
+        threshold = model.expected - 1.5
+
+    ct = [_LETTER_INDEX[c] for c in encrypted]
+    if len(ct) % 2 == 1 or len(ct) < model.n:
+        raise RuntimeError("Encrypted message is too short or has an odd length")
+
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(64) for _ in range(restarts)]
+    best = multiprocessing.Value("d", -math.inf)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_crack, initargs=(model, best)
+    ) as pool:
+        results = list(
+            pool.map(
+                _anneal,
+                [ct] * restarts,
+                [iterations] * restarts,
+                [temperature] * restarts,
+                [threshold] * restarts,
+                seeds,
+            )
+        )
+
+    score, cells = max(results)
+    key = [[_ALPHABET[c] for c in cells[r * 5 : r * 5 + 5]] for r in range(5)]
+    return (compile_key(key), score)
+
+
+def _cell_table(shift: int) -> list[tuple[int, int]]:
+    """
+    Same as `_digram_table` but maps pairs of cells (`a * 25 + b`, cells numbered row by row)
+    to pairs of cells, independently of the key.
+    """
+    table = []
+    for a in range(25):
+        for b in range(25):
+            r1, c1 = divmod(a, 5)
+            r2, c2 = divmod(b, 5)
+            if r1 == r2:
+                table.append((r1 * 5 + (c1 + shift) % 5, r2 * 5 + (c2 + shift) % 5))
+            elif c1 == c2:
+                table.append(((r1 + shift) % 5 * 5 + c1, (r2 + shift) % 5 * 5 + c2))
+            else:
+                table.append((r1 * 5 + c2, r2 * 5 + c1))
+    return table
+
+
+_ENCRYPT_CELLS = _cell_table(1)
+_DECRYPT_CELLS = _cell_table(-1)
+
+
+class _KeySolver:
+    """
+    Backtracking search over letter placements, propagating digram constraints after each placement.
+    """
+
+    def __init__(self, constraints: list[tuple[str, str, str, str]]):
+        self.constraints = constraints
+        # constraints indexed by the letters they mention
+        self.index = dict((c, []) for c in _ALPHABET)
+        for constraint in constraints:
+            for c in set(constraint):
+                self.index[c].append(constraint)
+        self.cell_of = {}
+        self.letter_at = [None] * 25
+        self.trail = []
+
+    def _place(self, c: str, cell: int, queue: list[str]) -> bool:
+        if c in self.cell_of:
+            return self.cell_of[c] == cell
+        if self.letter_at[cell] is not None:
+            return False
+        self.cell_of[c] = cell
+        self.letter_at[cell] = c
+        self.trail.append(c)
+        queue.append(c)
+        return True
+
+    def _check(self, p1: str, p2: str, c1: str, c2: str, queue: list[str]) -> bool:
+        cell_of = self.cell_of
+        a, b, x, y = (cell_of.get(c) for c in (p1, p2, c1, c2))
+
+        # two known letters on one side determine the other side
+        if a is not None and b is not None:
+            ex, ey = _ENCRYPT_CELLS[a * 25 + b]
+            return self._place(c1, ex, queue) and self._place(c2, ey, queue)
+        if x is not None and y is not None:
+            da, db = _DECRYPT_CELLS[x * 25 + y]
+            return self._place(p1, da, queue) and self._place(p2, db, queue)
+
+        # a plaintext letter and its ciphertext letter share a row, unless it is shifted down
+        for p, c in ((a, x), (b, y)):
+            if p is not None and c is not None:
+                if not (c // 5 == p // 5 and c != p or c == (p + 5) % 25):
+                    return False
+        # a ciphertext letter shares a row or a column with the other plaintext letter
+        for p, c in ((b, x), (a, y)):
+            if p is not None and c is not None:
+                if c // 5 != p // 5 and c % 5 != p % 5:
+                    return False
+        return True
+
+    def place(self, c: str, cell: int) -> bool:
+        """
+        Places a letter and everything that follows from it. Returns false on a contradiction.
+        """
+        queue = []
+        if not self._place(c, cell, queue):
+            return False
+        while queue:
+            for constraint in self.index[queue.pop()]:
+                if not self._check(*constraint, queue):
+                    return False
+        return True
+
+    def undo(self, length: int):
+        while len(self.trail) > length:
+            c = self.trail.pop()
+            self.letter_at[self.cell_of.pop(c)] = None
+
+    def solve(self, letters: list[str]) -> Iterator[list[str]]:
+        """
+        Yields every completion of the current placement as a flat list of 25 letters.
+        """
+        letters = [c for c in letters if c not in self.cell_of]
+        if not letters:
+            # letters without constraints can go anywhere
+            free_letters = [c for c in _ALPHABET if c not in self.cell_of]
+            free_cells = [i for i in range(25) if self.letter_at[i] is None]
+            for perm in permutations(free_letters):
+                cells = self.letter_at[:]
+                for i, c in zip(free_cells, perm):
+                    cells[i] = c
+                yield cells
+            return
+
+        length = len(self.trail)
+        for cell in range(25):
+            if self.letter_at[cell] is None:
+                if self.place(letters[0], cell):
+                    yield from self.solve(letters[1:])
+                self.undo(length)
+
+
+def known_plaintext_keys(pairs: list[tuple[str, str]]) -> Iterator[PlayfairKey]:
+    """
+    Finds every key consistent with the given (plaintext, ciphertext) pairs. Rotating the rows or
+    the columns of a key cyclically does not change encryption, so only keys with the most
+    constrained letter in the top left corner are returned.
+
+    Letters which do not appear in any digram can be placed arbitrarily, so with little known
+    plaintext there are many keys. They are generated lazily.
+    """
+    mapping = {}
+    for m, encrypted in pairs:
+        prepared = prepare_message(m)
+        encrypted = _pairs(encrypted)
+        if len(prepared) != len(encrypted):
+            raise RuntimeError("Plaintext and ciphertext do not have the same length")
+        for (p1, p2), (c1, c2) in zip(prepared, encrypted):
+            if mapping.setdefault(p1 + p2, c1 + c2) != c1 + c2:
+                # a key maps each digram to a single digram
+                return
+    # encryption is a bijection on digrams
+    if len(set(mapping.values())) != len(mapping):
+        return
+
+    solver = _KeySolver([(p[0], p[1], c[0], c[1]) for p, c in mapping.items()])
+
+    # most constrained letters first
+    letters = sorted(
+        (c for c in _ALPHABET if solver.index[c]), key=lambda c: -len(solver.index[c])
+    )
+    if not letters:
+        letters = [_ALPHABET[0]]
 
-    return m
+    # fixing the first letter in the top left corner removes the cyclic shifts
+    if not solver.place(letters[0], 0):
+        return
+    for cells in solver.solve(letters[1:]):
+        yield compile_key([cells[r * 5 : r * 5 + 5] for r in range(5)])
 
 
 if __name__ == "__main__":
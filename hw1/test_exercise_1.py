@@ -1,4 +1,27 @@
-from exercise_1 import decrypt, encrypt, prepare_key, prepare_message
+import os
+import tempfile
+
+from exercise_1 import (
+    NgramModel,
+    letter_ids,
+    crack,
+    decrypt_bytes,
+    decrypt_file,
+    encrypt_bytes,
+    encrypt_file,
+    encrypt_parallel,
+    encrypted_size,
+    english_model,
+    known_plaintext_keys,
+    PlayfairDecryptor,
+    PlayfairEncryptor,
+    PlayfairKey,
+    compile_key,
+    decrypt,
+    encrypt,
+    prepare_key,
+    prepare_message,
+)
 
 
 def test_check_key():
@@ -117,8 +140,209 @@ def test_decrypt():
     )
 
 
+def test_compile_key():
+    k = [
+        ["f", "o", "l", "i", "s"],
+        ["h", "c", "m", "p", "a"],
+        ["n", "y", "b", "d", "e"],
+        ["g", "k", "q", "r", "t"],
+        ["u", "v", "w", "x", "z"],
+    ]
+    compiled = compile_key(k)
+
+    assert isinstance(compiled, PlayfairKey)
+    assert compile_key(compiled) is compiled
+    # same normalized matrix hits the cache
+    assert compile_key([[c.upper() for c in r] for r in k]) is compiled
+    assert compiled == PlayfairKey(compiled.matrix)
+    assert hash(compiled) == hash(PlayfairKey(compiled.matrix))
+    assert len(compiled.encrypt_table) == len(compiled.decrypt_table) == 25 * 25
+
+    try:
+        compiled.matrix = ()
+        assert False
+    except AttributeError:
+        pass
+
+    assert encrypt(compiled, "caesar") == encrypt(k, "caesar") == "mhtapt"
+    assert decrypt(compiled, "mhtapt") == decrypt(k, "mhtapt") == "caesar"
+
+
+def test_stream():
+    k = [
+        ["f", "o", "l", "i", "s"],
+        ["h", "c", "m", "p", "a"],
+        ["n", "y", "b", "d", "e"],
+        ["g", "k", "q", "r", "t"],
+        ["u", "v", "w", "x", "z"],
+    ]
+    m = "Hello, balloon keeper! Three little jiggly puppies."
+    encrypted = encrypt(k, m)
+
+    for size in range(1, 8):
+        encryptor = PlayfairEncryptor(k)
+        chunks = [m[i : i + size] for i in range(0, len(m), size)]
+        assert "".join(encryptor.update(c) for c in chunks) + encryptor.finalize() == (
+            encrypted
+        )
+
+        decryptor = PlayfairDecryptor(k)
+        chunks = [encrypted[i : i + size] for i in range(0, len(encrypted), size)]
+        assert "".join(decryptor.update(c) for c in chunks) + decryptor.finalize() == (
+            decrypt(k, encrypted)
+        )
+
+    # doubled letters split across chunks
+    encryptor = PlayfairEncryptor(k)
+    assert encryptor.update("ab") + encryptor.update("ba") + encryptor.finalize() == (
+        encrypt(k, "abba")
+    )
+
+    encryptor = PlayfairEncryptor(k)
+    try:
+        encryptor.update("zax")
+        encryptor.update("xaz")
+        assert False
+    except RuntimeError:
+        pass
+
+    encryptor = PlayfairEncryptor(k)
+    try:
+        encryptor.update("xamax")
+        encryptor.finalize()
+        assert False
+    except RuntimeError:
+        pass
+
+    decryptor = PlayfairDecryptor(k)
+    try:
+        decryptor.update("mht")
+        decryptor.finalize()
+        assert False
+    except RuntimeError:
+        pass
+
+
+def test_bytes():
+    k = [
+        ["f", "o", "l", "i", "s"],
+        ["h", "c", "m", "p", "a"],
+        ["n", "y", "b", "d", "e"],
+        ["g", "k", "q", "r", "t"],
+        ["u", "v", "w", "x", "z"],
+    ]
+    m = "Hello, balloon keeper! Three little jiggly puppies."
+    encrypted = encrypt(k, m)
+
+    assert encrypted_size(m.encode()) == len(encrypted)
+    assert encrypt_bytes(k, m.encode()) == encrypted.encode()
+    assert encrypt_bytes(k, memoryview(m.encode())) == encrypted.encode()
+    assert decrypt_bytes(k, encrypted.encode()) == decrypt(k, encrypted).encode()
+
+    try:
+        encrypt_bytes(k, b"zaxxaz")
+        assert False
+    except RuntimeError:
+        pass
+
+    with tempfile.TemporaryDirectory() as d:
+        src, dst, back = (os.path.join(d, f) for f in ("src", "dst", "back"))
+        with open(src, "wb") as f:
+            f.write(m.encode())
+
+        assert encrypt_file(k, src, dst) == len(encrypted)
+        with open(dst, "rb") as f:
+            assert f.read() == encrypted.encode()
+
+        assert decrypt_file(k, dst, back) == len(encrypted)
+        with open(back, "rb") as f:
+            assert f.read() == decrypt(k, encrypted).encode()
+
+
+def test_encrypt_parallel():
+    k = [
+        ["f", "o", "l", "i", "s"],
+        ["h", "c", "m", "p", "a"],
+        ["n", "y", "b", "d", "e"],
+        ["g", "k", "q", "r", "t"],
+        ["u", "v", "w", "x", "z"],
+    ]
+
+    for m in ["", "abc", "abba", "aabbccdd", "Hello, balloon keeper! " * 50]:
+        assert encrypt_parallel(k, m, workers=3) == encrypt(k, m)
+
+    try:
+        encrypt_parallel(k, "zax" + " " * 20 + "xaz", workers=3)
+        assert False
+    except RuntimeError:
+        pass
+
+
+def test_ngram_model():
+    model = NgramModel.from_text("the cat sat on the mat", 2)
+
+    assert model.score(letter_ids("that")) > model.score(letter_ids("zqvw"))
+    assert model.score(letter_ids("the")) == model.score(letter_ids("the"), 0, 1) + (
+        model.score(letter_ids("the"), 1)
+    )
+
+    english = english_model()
+    assert english.score(letter_ids("attackatdawn")) > english.score(
+        letter_ids("qzvxkjwqpfyb")
+    )
+
+
+def test_crack():
+    k = [
+        ["f", "o", "l", "i", "s"],
+        ["h", "c", "m", "p", "a"],
+        ["n", "y", "b", "d", "e"],
+        ["g", "k", "q", "r", "t"],
+        ["u", "v", "w", "x", "z"],
+    ]
+    encrypted = encrypt(k, "Hello, balloon keeper! Three little jiggly puppies.")
+    model = english_model()
+
+    key, score = crack(encrypted, restarts=2, iterations=500, workers=1, seed=0)
+
+    # the incrementally updated score matches a full rescore of the found key
+    ids = letter_ids(decrypt(key, encrypted))
+    assert abs(score - model.score(ids) / (len(ids) - model.n + 1)) < 1e-9
+
+
+def test_known_plaintext_keys():
+    k = [
+        ["f", "o", "l", "i", "s"],
+        ["h", "c", "m", "p", "a"],
+        ["n", "y", "b", "d", "e"],
+        ["g", "k", "q", "r", "t"],
+        ["u", "v", "w", "x", "z"],
+    ]
+    m = "To speak of Don Quixote as if it were merely a humorous book would be a manifest misdescription. Cervantes at times makes it a kind of commonplace book for occasional essays and criticisms."
+
+    keys = list(known_plaintext_keys([(m, encrypt(k, m))]))
+    assert len(keys) == 1
+    # equal up to cyclic shifts of rows and columns
+    assert keys[0].encrypt_table == compile_key(k).encrypt_table
+
+    # every key consistent with little known plaintext encrypts it the same way
+    for key in list(known_plaintext_keys([("caesar", "mhtapt")]))[:100]:
+        assert encrypt(key, "caesar") == "mhtapt"
+
+    assert (
+        list(known_plaintext_keys([("caesar", "mhtapt"), ("caesar", "mhtapa")])) == []
+    )
+
+
 if __name__ == "__main__":
     test_check_key()
     test_prepare_message()
     test_encrypt()
     test_decrypt()
+    test_compile_key()
+    test_stream()
+    test_bytes()
+    test_encrypt_parallel()
+    test_ngram_model()
+    test_crack()
+    test_known_plaintext_keys()